@@ -1,24 +1,86 @@
-from fastapi import FastAPI, Header, HTTPException, Depends
+from fastapi import FastAPI, Header, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, validator
+import orjson
+import asyncio
+import functools
 import os
 import random
 import time
-import threading
-from datetime import datetime
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
 from typing import Optional
 
-app = FastAPI(title="payment-service-demo")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    generator = asyncio.create_task(log_generator())
+    yield
+    generator.cancel()
+    with suppress(asyncio.CancelledError):
+        await generator
+
+app = FastAPI(title="payment-service-demo", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 DEMO_SECRET = os.environ.get("DEMO_SECRET")
 if not DEMO_SECRET:
     raise RuntimeError("DEMO_SECRET env var is required — set it in Render environment variables")
 
-def require_secret(x_demo_secret: str = Header(default="")):
+async def require_secret(x_demo_secret: str = Header(default="")):
     if DEMO_SECRET and x_demo_secret != DEMO_SECRET:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-_runbook_lock = threading.Lock()
+_runbook_lock = asyncio.Lock()
+
+# Strong references so pending tasks are not garbage-collected mid-sleep.
+_background_tasks: set = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# ── Response cache ────────────────────────────────────────────────────────────
+
+_ttl_entries: dict = {}
+
+def ttl_cache(seconds: float):
+    """Share one materialized response per endpoint for `seconds`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            now = time.monotonic()
+            hit = _ttl_entries.get(func.__name__)
+            if hit and hit[0] > now:
+                return hit[1]
+            value = await func(*args, **kwargs)
+            _ttl_entries[func.__name__] = (now + seconds, value)
+            return value
+        return wrapper
+    return decorator
+
+ttl_cache.invalidate_all = _ttl_entries.clear
+
+# Dashboard poll endpoints: caches may keep a copy but must revalidate it
+# (cheaply, via the ETag) on every poll, so the live demo never lags.
+POLL_CACHE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Vary": "Accept-Encoding",
+}
+
+def etag_response(request: Request, payload, etag: str, extra_headers: Optional[dict] = None) -> Response:
+    """Return a 304 if the client already holds `etag`, else `payload` tagged with it.
+
+    `payload` is a dict to serialize or already-encoded JSON bytes.
+    """
+    headers = {**(extra_headers or {}), "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if isinstance(payload, bytes):
+        return Response(payload, media_type="application/json", headers=headers)
+    return ORJSONResponse(payload, headers=headers)
 
 @app.middleware("http")
 async def add_security_headers(request, call_next):
@@ -44,37 +106,81 @@ app.add_middleware(
 
 # ── Service State ─────────────────────────────────────────────────────────────
 
+RUNBOOK_STEPS = [
+    "🔍 Health check → UNHEALTHY detected",
+    "📋 Fetching logs & analyzing root cause",
+    "🔄 Restarting service",
+    "✅ Verifying recovery",
+    "📨 Notifying team — incident report sent",
+]
+
+_ts_cache = [0, ""]
+
+def _now_hms() -> str:
+    """UTC HH:MM:SS, formatted at most once per second."""
+    t = int(time.time())
+    if t == _ts_cache[0]:
+        return _ts_cache[1]
+    s = time.strftime("%H:%M:%S", time.gmtime(t))
+    _ts_cache[0], _ts_cache[1] = t, s
+    return s
+
+@dataclass(slots=True)
+class LogEntry:
+    timestamp: str
+    level: str
+    message: str
+
+@dataclass(slots=True)
+class RunbookStep:
+    step: str
+    status: str
+    ts: str
+    detail: Optional[str] = None
+
+# Only touched from the event loop (async endpoints and background tasks),
+# so mutations need no lock. Keep service handlers `async def` to preserve this.
+# _add_log is the single writer for logs/last5; producers on other threads
+# must hand entries over with loop.call_soon_threadsafe rather than a lock.
 class ServiceState:
     def __init__(self):
+        # Never reset, so an ETag from before /admin/reset can't match again.
+        self.version = 0
         self.reset()
 
     def reset(self):
         self.status = "healthy"
         self.chaos_mode = None
         self.started_at = time.time()
+        # Wall-clock timestamps are exposed to the dashboard; durations use
+        # the monotonic twins so clock adjustments can't skew MTTR.
         self.incident_started_at: Optional[float] = None
         self.incident_resolved_at: Optional[float] = None
-        self.runbook_steps = []
+        self.incident_started_mono: Optional[float] = None
+        self.incident_resolved_mono: Optional[float] = None
+        self.runbook_steps = deque(maxlen=len(RUNBOOK_STEPS))
         self.runbook_running = False
-        self.logs = []
+        self.root_cause: Optional[str] = None
+        self.logs = deque(maxlen=50)
+        self.last5 = deque(maxlen=5)
         self.payment_counter = 0
         self._add_log("INFO", "payment-service started successfully")
         self._add_log("INFO", "Connected to database pool (max: 100 connections)")
         self._add_log("INFO", "Listening on :8080")
 
     def _add_log(self, level: str, message: str):
-        entry = {
-            "timestamp": datetime.utcnow().strftime("%H:%M:%S"),
-            "level": level,
-            "message": message
-        }
+        entry = LogEntry(_now_hms(), level, message)
         self.logs.append(entry)
-        if len(self.logs) > 50:
-            self.logs = self.logs[-50:]
+        self.last5.append(entry)
+        self.touch()
 
     def add_log(self, level: str, message: str):
         self._add_log(level, message)
 
+    def touch(self):
+        self.version += 1
+        ttl_cache.invalidate_all()
+
 state = ServiceState()
 
 # ── Challenge State ───────────────────────────────────────────────────────────
@@ -243,137 +349,157 @@ challenge = ChallengeState()
 
 # ── Background log generator ──────────────────────────────────────────────────
 
-def log_generator():
-    amounts = [44, 88, 99, 142, 176, 210, 255, 304, 89, 133, 67, 198]
+AMOUNTS = (44, 88, 99, 142, 176, 210, 255, 304, 89, 133, 67, 198)
+
+MSGS_POOL = {
+    "connection_pool": (
+        "ERROR: Connection pool exhausted (100/100 connections in use)",
+        "WARN: Retry 3/3 failed — no connections available",
+        "ERROR: DB timeout after 30s — connection pool saturated",
+        "ERROR: Payment rejected — cannot acquire DB connection",
+        "WARN: Queue depth: 847 pending requests",
+    ),
+    "timeout": (
+        "ERROR: Request timeout after 30000ms",
+        "WARN: Downstream service not responding",
+        "ERROR: Circuit breaker OPEN — payment-service",
+        "ERROR: Health probe failed (3/3 retries)",
+    ),
+    "random_crash": (
+        "FATAL: Unexpected panic in payment handler",
+        "ERROR: nil pointer dereference at payment.go:142",
+        "ERROR: Service crashed — restarting (attempt 1/3)",
+        "ERROR: Restart failed — still crashing",
+    ),
+}
+
+async def log_generator():
     while True:
-        time.sleep(12)
+        await asyncio.sleep(12)
         if state.status == "healthy":
-            amount = random.choice(amounts)
+            amount = random.choice(AMOUNTS)
             state.add_log("INFO", f"Payment processed OK — ${amount} (txn #{state.payment_counter + 1000})")
             state.payment_counter += 1
         elif state.status == "unhealthy":
-            if state.chaos_mode == "connection_pool":
-                msgs = [
-                    "ERROR: Connection pool exhausted (100/100 connections in use)",
-                    "WARN: Retry 3/3 failed — no connections available",
-                    "ERROR: DB timeout after 30s — connection pool saturated",
-                    "ERROR: Payment rejected — cannot acquire DB connection",
-                    "WARN: Queue depth: 847 pending requests",
-                ]
-            elif state.chaos_mode == "timeout":
-                msgs = [
-                    "ERROR: Request timeout after 30000ms",
-                    "WARN: Downstream service not responding",
-                    "ERROR: Circuit breaker OPEN — payment-service",
-                    "ERROR: Health probe failed (3/3 retries)",
-                ]
-            else:
-                msgs = [
-                    "FATAL: Unexpected panic in payment handler",
-                    "ERROR: nil pointer dereference at payment.go:142",
-                    "ERROR: Service crashed — restarting (attempt 1/3)",
-                    "ERROR: Restart failed — still crashing",
-                ]
+            msgs = MSGS_POOL.get(state.chaos_mode, MSGS_POOL["random_crash"])
             state.add_log("ERROR", random.choice(msgs))
 
-threading.Thread(target=log_generator, daemon=True).start()
-
 # ── Runbook automation ────────────────────────────────────────────────────────
 
-RUNBOOK_STEPS = [
-    "🔍 Health check → UNHEALTHY detected",
-    "📋 Fetching logs & analyzing root cause",
-    "🔄 Restarting service",
-    "✅ Verifying recovery",
-    "📨 Notifying team — incident report sent",
-]
-
-def run_runbook():
-    with _runbook_lock:
+ROOT_CAUSES = {
+    "connection_pool": "Connection pool exhausted (100/100)",
+    "timeout": "Downstream timeout — circuit breaker tripped",
+    "random_crash": "Nil pointer dereference in payment handler",
+}
+
+async def _step_detect(step: RunbookStep, state: ServiceState) -> None:
+    await asyncio.sleep(random.uniform(1.5, 3.5))
+    step.status = "done"
+    state.add_log("INFO", f"Runbook [1/5]: {step.step}")
+
+async def _step_diagnose(step: RunbookStep, state: ServiceState) -> None:
+    await asyncio.sleep(random.uniform(2.0, 5.0))
+    root_cause = ROOT_CAUSES.get(state.chaos_mode, "Unknown error")
+    step.status = "done"
+    step.detail = root_cause
+    state.root_cause = root_cause
+    state.add_log("INFO", f"Root cause identified: {root_cause}")
+
+async def _step_restart(step: RunbookStep, state: ServiceState) -> None:
+    await asyncio.sleep(random.uniform(3.0, 6.0))
+    state.status = "recovering"
+    state.add_log("INFO", "Restarting payment-service...")
+    await asyncio.sleep(random.uniform(2.0, 5.0))
+    state.status = "healthy"
+    state.incident_resolved_at = time.time()
+    state.incident_resolved_mono = time.monotonic()
+    step.status = "done"
+    state.add_log("INFO", "✅ Service restarted successfully — health check PASSED")
+
+async def _step_verify(step: RunbookStep, state: ServiceState) -> None:
+    await asyncio.sleep(random.uniform(1.5, 3.5))
+    step.status = "done"
+    state.add_log("INFO", "Recovery verified — payment processing resumed")
+
+async def _step_notify(step: RunbookStep, state: ServiceState) -> None:
+    await asyncio.sleep(random.uniform(0.5, 2.0))
+    mttr = round(state.incident_resolved_mono - state.incident_started_mono)
+    step.status = "done"
+    state.add_log("INFO", f"📨 Incident report: MTTR={mttr}s | Root cause: {state.chaos_mode}")
+
+# One handler per entry in RUNBOOK_STEPS, in the same order.
+STEP_HANDLERS = [_step_detect, _step_diagnose, _step_restart, _step_verify, _step_notify]
+
+async def run_runbook():
+    async with _runbook_lock:
         state.runbook_running = True
-        state.runbook_steps = []
+        state.runbook_steps.clear()
+        state.root_cause = None
         state.add_log("INFO", "🤖 Runbook triggered automatically")
 
-        for i, step_name in enumerate(RUNBOOK_STEPS):
-            step = {"step": step_name, "status": "running", "ts": datetime.utcnow().strftime("%H:%M:%S")}
+        for step_name, handler in zip(RUNBOOK_STEPS, STEP_HANDLERS):
+            step = RunbookStep(step_name, "running", _now_hms())
             state.runbook_steps.append(step)
-
-            if i == 0:
-                time.sleep(random.uniform(1.5, 3.5))
-                step["status"] = "done"
-                state.add_log("INFO", f"Runbook [1/5]: {step_name}")
-            elif i == 1:
-                time.sleep(random.uniform(2.0, 5.0))
-                root_cause = {
-                    "connection_pool": "Connection pool exhausted (100/100)",
-                    "timeout": "Downstream timeout — circuit breaker tripped",
-                    "random_crash": "Nil pointer dereference in payment handler",
-                }.get(state.chaos_mode, "Unknown error")
-                step["status"] = "done"
-                step["detail"] = root_cause
-                state.add_log("INFO", f"Root cause identified: {root_cause}")
-            elif i == 2:
-                time.sleep(random.uniform(3.0, 6.0))
-                state.status = "recovering"
-                state.add_log("INFO", "Restarting payment-service...")
-                time.sleep(random.uniform(2.0, 5.0))
-                state.status = "healthy"
-                state.incident_resolved_at = time.time()
-                step["status"] = "done"
-                state.add_log("INFO", "✅ Service restarted successfully — health check PASSED")
-            elif i == 3:
-                time.sleep(random.uniform(1.5, 3.5))
-                step["status"] = "done"
-                state.add_log("INFO", "Recovery verified — payment processing resumed")
-            elif i == 4:
-                time.sleep(random.uniform(0.5, 2.0))
-                mttr = round(state.incident_resolved_at - state.incident_started_at)
-                step["status"] = "done"
-                state.add_log("INFO", f"📨 Incident report: MTTR={mttr}s | Root cause: {state.chaos_mode}")
+            state.touch()
+            await handler(step, state)
 
         state.runbook_running = False
+        state.touch()
 
 # ── Service Endpoints ─────────────────────────────────────────────────────────
 
-@app.get("/health")
-def health():
-    return {"status": state.status}
+# The /health body depends only on status, so every possible one is encoded up front.
+HEALTH_RESPONSES = {s: orjson.dumps({"status": s}) for s in ("healthy", "unhealthy", "recovering")}
 
-@app.get("/logs")
-def get_logs():
-    return {"logs": state.logs[-5:]}
+# Payload builders return (version, payload) so the ETag names the state
+# the body was built from, not whatever state.version is by the time it's sent.
+@ttl_cache(0.5)
+async def _logs_body():
+    return state.version, {"logs": list(state.last5)}
 
-@app.get("/state")
-def get_state():
+@ttl_cache(0.5)
+async def _state_body():
     mttr = None
-    if state.incident_resolved_at and state.incident_started_at:
-        mttr = round(state.incident_resolved_at - state.incident_started_at)
+    if state.incident_resolved_mono and state.incident_started_mono:
+        mttr = round(state.incident_resolved_mono - state.incident_started_mono)
 
-    incident_elapsed = None
-    if state.incident_started_at and not state.incident_resolved_at:
-        incident_elapsed = round(time.time() - state.incident_started_at)
-
-    root_cause = None
-    for s in state.runbook_steps:
-        if s.get("detail"):
-            root_cause = s["detail"]
-
-    return {
+    # Only fixed timestamps here — a per-second counter (uptime, elapsed)
+    # would change the body every second and defeat the ETag.
+    return state.version, {
         "status": state.status,
         "chaos_mode": state.chaos_mode,
-        "uptime": round(time.time() - state.started_at),
+        "started_at": state.started_at,
         "incident_started_at": state.incident_started_at,
         "incident_resolved_at": state.incident_resolved_at,
-        "incident_elapsed": incident_elapsed,
         "mttr": mttr,
         "runbook_running": state.runbook_running,
-        "runbook_steps": state.runbook_steps,
-        "logs": state.logs[-5:],
-        "root_cause": root_cause,
+        "runbook_steps": list(state.runbook_steps),
+        "logs": list(state.last5),
+        "root_cause": state.root_cause,
     }
 
+@app.get("/health", response_class=ORJSONResponse)
+async def health(request: Request):
+    return etag_response(request, HEALTH_RESPONSES[state.status], f'W/"{state.status}"')
+
+@app.get("/logs", response_class=ORJSONResponse)
+async def get_logs(request: Request):
+    version, payload = await _logs_body()
+    return etag_response(request, payload, f'W/"{version}"', POLL_CACHE_HEADERS)
+
+@app.get("/state", response_class=ORJSONResponse)
+async def get_state(request: Request):
+    version, payload = await _state_body()
+    return etag_response(request, payload, f'W/"{version}"', POLL_CACHE_HEADERS)
+
 VALID_CHAOS_MODES = {"connection_pool", "timeout", "random_crash"}
 
+MODE_LABELS = {
+    "connection_pool": "Connection pool exhausted",
+    "timeout": "Downstream timeout",
+    "random_crash": "Service panic / crash",
+}
+
 class ChaosRequest(BaseModel):
     mode: str = "connection_pool"
     auto_runbook_delay: int = 8
@@ -385,37 +511,37 @@ class ChaosRequest(BaseModel):
         return v
 
 @app.post("/admin/chaos")
-def trigger_chaos(req: ChaosRequest, _: str = Depends(require_secret)):
+async def trigger_chaos(req: ChaosRequest, _: str = Depends(require_secret)):
     if state.status != "healthy":
         return {"error": "Service is not healthy — reset first"}
     state.status = "unhealthy"
     state.chaos_mode = req.mode
     state.incident_started_at = time.time()
     state.incident_resolved_at = None
-    state.runbook_steps = []
-    mode_labels = {
-        "connection_pool": "Connection pool exhausted",
-        "timeout": "Downstream timeout",
-        "random_crash": "Service panic / crash",
-    }
-    state.add_log("ERROR", f"🚨 INCIDENT: {mode_labels.get(req.mode, req.mode)}")
-
-    def delayed_runbook():
-        time.sleep(req.auto_runbook_delay)
+    state.incident_started_mono = time.monotonic()
+    state.incident_resolved_mono = None
+    state.runbook_steps.clear()
+    state.root_cause = None
+    state.add_log("ERROR", f"🚨 INCIDENT: {MODE_LABELS.get(req.mode, req.mode)}")
+
+    async def delayed_runbook():
+        await asyncio.sleep(req.auto_runbook_delay)
         if state.status == "unhealthy" and not state.runbook_running:
-            run_runbook()
+            await run_runbook()
 
-    threading.Thread(target=delayed_runbook, daemon=True).start()
+    spawn(delayed_runbook())
+    state.touch()
     return {"ok": True, "mode": req.mode}
 
 @app.post("/admin/reset")
-def reset(_: str = Depends(require_secret)):
+async def reset(_: str = Depends(require_secret)):
     state.reset()
+    state.touch()
     return {"ok": True}
 
-@app.get("/")
-def root():
-    return {"service": "payment-service-demo", "status": state.status}
+@app.get("/", response_class=ORJSONResponse)
+async def root():
+    return ORJSONResponse({"service": "payment-service-demo", "status": state.status})
 
 # ── Challenge Endpoints ───────────────────────────────────────────────────────
 
@@ -553,3 +679,18 @@ def next_step(_: str = Depends(require_secret)):
 def reset_challenge(_: str = Depends(require_secret)):
     challenge.reset()
     return {"ok": True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # ServiceState is process-local: more than one worker would split the
+    # demo state across processes, so scale out only via WEB_CONCURRENCY.
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8080)),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+    )